@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 import plistlib
-import base64
+import json
 import os
 import sys
 import subprocess
@@ -10,13 +10,14 @@ import time
 import argparse
 import threading
 import shutil
+import signal
 import tempfile
-from datetime import datetime
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Optional, Dict, Any, Tuple, Literal
-
-# Add specific exception import
 from plistlib import InvalidFileException
+from xml.parsers.expat import ExpatError
+from typing import List, Optional, Dict, Any, Tuple, Literal, FrozenSet
 
 # --- Constants ---
 
@@ -32,6 +33,24 @@ COLORS = {
 PATCH_COMMENT_BASE = "Sonoma VM BT Enabler"
 PATCH_COMMENT_1 = f"{PATCH_COMMENT_BASE} - PART 1 of 2 - Patch kern.hv_vmm_present=0"
 PATCH_COMMENT_2 = f"{PATCH_COMMENT_BASE} - PART 2 of 2 - Patch kern.hv_vmm_present=0"
+_PATCH_COMMENTS = frozenset({PATCH_COMMENT_1, PATCH_COMMENT_2})
+
+# 'diskutil list -plist' Content values that identify an EFI System Partition
+EFI_CONTENT_TYPES = {"EFI", "C12A7328-F81F-11D2-BA4B-00A0C93EC93B"}
+EFI_VOLUME_NAMES = {"EFI", "ESP", "BOOTCAMP", "BOOT", "NO NAME"}
+
+# Partition identifiers like disk0s1
+PARTITION_ID_RE = re.compile(r'^disk\d+s\d+$')
+
+# Mount state of EFI partitions as reported by the last 'diskutil list -plist' scan
+_KNOWN_MOUNT_POINTS: Dict[str, Optional[str]] = {}
+
+# Volume UUIDs of EFI partitions from the same scan, used to validate LAST_EFI_CACHE
+_KNOWN_VOLUME_UUIDS: Dict[str, Optional[str]] = {}
+
+# Remembers which EFI partition held the OpenCore config on the last successful scan.
+# The script runs under sudo, so this lives in the system cache rather than the user's home
+LAST_EFI_CACHE = Path("/Library/Caches/bt-vmhide/last_efi.json")
 
 # Global debug flag
 DEBUG_MODE = False
@@ -39,130 +58,181 @@ DEBUG_MODE = False
 # --- Utility Classes and Functions ---
 
 class Spinner:
-    """Displays a spinning cursor in the terminal."""
-    def __init__(self, message: str = "Processing", delay: float = 0.1):
+    """Displays a spinning cursor in the terminal.
+
+    Frames are drawn from a SIGALRM interval timer rather than a helper thread.
+    Animation is only shown when ``animate`` is true (defaults to whether stdout
+    is a TTY) and the spinner runs on the main thread; otherwise start/stop just
+    print the final messages.
+    """
+    def __init__(self, message: str = "Processing", delay: float = 0.1, animate: Optional[bool] = None):
         self._spinner_chars = ["⠋", "⠙", "⠹", "⠸", "⠼", "⠴", "⠦", "⠧", "⠇", "⠏"]
         self._delay = delay
         self._message = message
+        self._animate = (sys.stdout.isatty() if animate is None else animate) and hasattr(signal, 'setitimer')
         self._running = False
-        self._spinner_thread: Optional[threading.Thread] = None
-        self._lock = threading.Lock()
-
-    def _spin(self) -> None:
-        i = 0
-        while self._running:
-            with self._lock:
-                if not self._running: # Check again after acquiring lock
-                    break
-                char = self._spinner_chars[i % len(self._spinner_chars)]
-                # Ensure message doesn't change mid-write
-                current_message = self._message
-                line = f"\r{COLORS['CYAN']}{char} {current_message}{COLORS['RESET']} "
-                sys.stdout.write(line)
-                sys.stdout.flush()
-            time.sleep(self._delay)
-            i += 1
+        self._frame = 0
+        self._previous_handler: Any = None
+
+    def _tick(self, signum: int, frame: Any) -> None:
+        """SIGALRM handler: draws the next frame."""
+        if not self._running:
+            return
+        char = self._spinner_chars[self._frame % len(self._spinner_chars)]
+        self._frame += 1
+        line = f"\r{COLORS['CYAN']}{char} {self._message}{COLORS['RESET']} "
+        # os.write bypasses sys.stdout's buffer, which the interrupted code may be in the middle of using
+        os.write(sys.stdout.fileno(), line.encode('utf-8'))
 
     def start(self, message: Optional[str] = None) -> None:
         """Starts the spinner animation."""
-        with self._lock:
-            if self._running:
-                # Update message if spinner is already running
-                if message:
-                    self._message = message
-                return # Already running
-            if message:
-                self._message = message
-            self._running = True
-            self._spinner_thread = threading.Thread(target=self._spin, daemon=True)
-            self._spinner_thread.start()
+        if message:
+            self._message = message # A plain attribute swap; the handler reads whichever is current
+        if self._running or not self._animate:
+            return # Already running, or non-interactive
+        if threading.current_thread() is not threading.main_thread():
+            self._animate = False # Signal handlers can only be installed from the main thread
+            return
+        self._running = True
+        self._previous_handler = signal.signal(signal.SIGALRM, self._tick)
+        self._tick(signal.SIGALRM, None) # Draw the first frame immediately
+        signal.setitimer(signal.ITIMER_REAL, self._delay, self._delay)
 
     def stop(self, final_message: Optional[str] = None) -> None:
         """Stops the spinner animation and optionally prints a final message."""
-        with self._lock:
-            if not self._running:
-                return # Already stopped
-            self._running = False
-            # Clear the spinner line based on the *last* message shown
-            clear_line = '\r' + ' ' * (len(self._message) + 5) + '\r'
-            sys.stdout.write(clear_line)
-            sys.stdout.flush()
-
-        if self._spinner_thread:
-            self._spinner_thread.join(timeout=1.0) # Add timeout to join
-            if self._spinner_thread.is_alive():
-                 log("Spinner thread did not exit cleanly.", "DEBUG")
-            self._spinner_thread = None
-
-        if final_message:
-            print(final_message)
-        # Ensure cursor is at the beginning of the next line if no final message
-        elif not final_message and not clear_line.endswith('\n'):
-             print() # Move to next line
+        if not self._animate:
+            if final_message:
+                # Single write so lines from concurrent spinners don't interleave
+                sys.stdout.write(final_message + "\n")
+            return
+
+        if not self._running:
+            return # Already stopped
+        self._running = False # Any tick still pending sees this and draws nothing
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, self._previous_handler or signal.SIG_DFL)
+
+        # Clear the spinner line based on the *last* message shown
+        clear_line = '\r' + ' ' * (len(self._message) + 5) + '\r'
+        sys.stdout.write(clear_line)
+        sys.stdout.write((final_message or "") + "\n") # Move to next line
+        sys.stdout.flush()
 
     def set_message(self, message: str) -> None:
         """Updates the spinner message dynamically."""
-        with self._lock:
-            self._message = message
+        self._message = message
 
 
-def log(message: str, level: str = "INFO", timestamp: bool = True, color_override: Optional[str] = None) -> None:
-    """Logs a message to the console with appropriate coloring."""
-    if level == "DEBUG" and not DEBUG_MODE:
-        return # Suppress debug messages if not enabled
+# Per-level (color, level tag) pairs for log(); rebuilt by _build_log_styles() when COLORS changes
+_LOG_STYLES: Dict[str, Tuple[str, str]] = {}
 
+
+def _build_log_styles() -> None:
+    """Precomputes the color and tag log() uses for each level."""
     level_colors = {
         "INFO": COLORS['BLUE'], "ERROR": COLORS['RED'], "SUCCESS": COLORS['GREEN'],
         "WARNING": COLORS['YELLOW'], "DEBUG": COLORS['MAGENTA'],
         "TITLE": COLORS['MAGENTA'] + COLORS['BOLD'], "HEADER": COLORS['CYAN'] + COLORS['BOLD'],
     }
-    color = color_override if color_override else level_colors.get(level, COLORS['RESET'])
-    time_str = f"[{datetime.now().strftime('%H:%M:%S')}] " if timestamp else ""
-    level_str = f"[{level}] " if level not in ["TITLE", "HEADER"] else ""
+    _LOG_STYLES.clear()
+    for level, color in level_colors.items():
+        _LOG_STYLES[level] = (color, "" if level in ("TITLE", "HEADER") else f"[{level}] ")
+
 
-    # Prepend DEBUG tag explicitly for clarity if level is DEBUG
-    if level == "DEBUG":
-        message = f"DEBUG: {message}"
-        level_str = "[DEBUG] " # Ensure DEBUG tag shows even if timestamp=False
+def log(message: str, level: str = "INFO", timestamp: bool = True, color_override: Optional[str] = None) -> None:
+    """Logs a message to the console with appropriate coloring."""
+    if level == "DEBUG" and not DEBUG_MODE:
+        return # Suppress debug messages if not enabled
 
-    formatted_message = f"{color}{time_str}{level_str}{message}{COLORS['RESET']}"
+    color, level_str = _LOG_STYLES.get(level) or (COLORS['RESET'], f"[{level}] ")
+    if color_override:
+        color = color_override
+    reset = COLORS['RESET']
 
+    # Every level is emitted as a single write, safe to call from worker threads
     if level == "TITLE":
-        print("\n" + "=" * 70)
-        print(f"{color}{message.center(70)}{COLORS['RESET']}")
-        print("=" * 70)
+        rule = "=" * 70
+        sys.stdout.write(f"\n{rule}\n{color}{message.center(70)}{reset}\n{rule}\n")
     elif level == "HEADER":
-        print(f"\n{color}=== {message} ==={COLORS['RESET']}")
+        sys.stdout.write(f"\n{color}=== {message} ==={reset}\n")
     else:
-        print(formatted_message)
-    sys.stdout.flush() # Ensure message is printed immediately
+        time_str = time.strftime("[%H:%M:%S] ") if timestamp else ""
+        if level == "DEBUG":
+            message = f"DEBUG: {message}" # Prepend DEBUG tag explicitly for clarity
+        sys.stdout.write(f"{color}{time_str}{level_str}{message}{reset}\n")
+    # No explicit flush: a TTY stdout is line-buffered, so each line still shows immediately,
+    # while piped or redirected output is block-buffered and lines are batched into few writes
+
+
+# Spinner result prefixes ("✓ ", "✗ ", "⚠ " plus color); rebuilt by _build_status_prefixes() when COLORS changes
+_OK = _FAIL = _WARN = _END = ""
+
+
+def _build_status_prefixes() -> None:
+    """Precomputes the colored status-line prefixes and the reset suffix."""
+    global _OK, _FAIL, _WARN, _END
+    _OK = f"{COLORS['GREEN']}✓ "
+    _FAIL = f"{COLORS['RED']}✗ "
+    _WARN = f"{COLORS['YELLOW']}⚠ "
+    _END = COLORS['RESET']
+
+
+_build_log_styles()
+_build_status_prefixes()
+
+
+# Absolute paths of executables already looked up on PATH
+_EXECUTABLE_PATHS: Dict[str, Optional[str]] = {}
+
+
+def _resolve_executable(name: str) -> str:
+    """Returns the absolute path for an executable name, caching PATH lookups."""
+    if os.path.isabs(name):
+        return name
+    if name not in _EXECUTABLE_PATHS:
+        _EXECUTABLE_PATHS[name] = shutil.which(name)
+    return _EXECUTABLE_PATHS[name] or name # Unresolved names still raise FileNotFoundError below
 
 
 def run_command(command: List[str], check: bool = True, capture_output: bool = True) -> Tuple[int, str, str]:
-    """Runs a shell command safely and returns status, stdout, stderr."""
-    log(f"Running command: {' '.join(command)}", "DEBUG", timestamp=False)
+    """Runs a shell command safely and returns status, stdout, stderr.
+
+    With capture_output=False stdout is discarded (returned as "") and only stderr is kept.
+    """
+    if DEBUG_MODE: # Skip formatting debug strings on normal runs
+        log(f"Running command: {' '.join(command)}", "DEBUG", timestamp=False)
     try:
+        # An absolute executable with close_fds=False lets CPython use posix_spawn instead of fork+exec.
+        # Our own descriptors are non-inheritable (PEP 446), so nothing leaks into the child.
         process = subprocess.run(
-            command,
+            [_resolve_executable(command[0])] + command[1:],
             check=check,
-            capture_output=capture_output,
+            close_fds=False,
+            stdout=subprocess.PIPE if capture_output else subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
             text=True,
             encoding='utf-8',
             errors='ignore' # Ignore potential decoding errors in output
         )
-        log(f"Command finished: rc={process.returncode}", "DEBUG", timestamp=False)
-        log(f"  stdout: {process.stdout.strip()}", "DEBUG", timestamp=False)
-        log(f"  stderr: {process.stderr.strip()}", "DEBUG", timestamp=False)
-        return process.returncode, process.stdout.strip(), process.stderr.strip()
+        stdout = (process.stdout or "").strip() # None when stdout was discarded
+        stderr = process.stderr.strip()
+        if DEBUG_MODE:
+            log(f"Command finished: rc={process.returncode}", "DEBUG", timestamp=False)
+            log(f"  stdout: {stdout}", "DEBUG", timestamp=False)
+            log(f"  stderr: {stderr}", "DEBUG", timestamp=False)
+        return process.returncode, stdout, stderr
     except FileNotFoundError:
         log(f"Error: Command not found: {command[0]}", "ERROR")
         return -1, "", f"Command not found: {command[0]}"
     except subprocess.CalledProcessError as e:
-        log(f"Command failed with rc={e.returncode}: {' '.join(command)}", "DEBUG")
-        log(f"  stdout: {e.stdout.strip()}", "DEBUG", timestamp=False)
-        log(f"  stderr: {e.stderr.strip()}", "DEBUG", timestamp=False)
+        stdout = (e.stdout or "").strip()
+        stderr = e.stderr.strip()
+        if DEBUG_MODE:
+            log(f"Command failed with rc={e.returncode}: {' '.join(command)}", "DEBUG")
+            log(f"  stdout: {stdout}", "DEBUG", timestamp=False)
+            log(f"  stderr: {stderr}", "DEBUG", timestamp=False)
         # Error already logged by check=True, but we return details
-        return e.returncode, e.stdout.strip(), e.stderr.strip()
+        return e.returncode, stdout, stderr
     except Exception as e:
         log(f"An unexpected error occurred running command '{' '.join(command)}': {e}", "ERROR")
         return -1, "", str(e)
@@ -189,10 +259,17 @@ def print_banner() -> None:
 
 
 def request_confirmation(prompt: str, default_yes: bool = False) -> bool:
-    """Asks the user for confirmation."""
+    """Asks the user for confirmation. Declines if stdin is exhausted (e.g. an empty pipe)."""
     suffix = " [Y/n]" if default_yes else " [y/N]"
+    full_prompt = f"{COLORS['YELLOW']}{prompt}{suffix}: {COLORS['RESET']}"
     while True:
-        response = input(f"{COLORS['YELLOW']}{prompt}{suffix}: {COLORS['RESET']}").strip().lower()
+        try:
+            response = input(full_prompt).strip().lower()
+        except EOFError:
+            # No one to answer: never assume "yes" (the restart prompt defaults to it)
+            print()
+            log("No input available; treating as 'no'. Use --yes for unattended runs.", "WARNING", timestamp=False)
+            return False
         if not response:
             return default_yes
         if response in ['y', 'yes']:
@@ -203,64 +280,48 @@ def request_confirmation(prompt: str, default_yes: bool = False) -> bool:
 
 # --- Core Logic Functions ---
 
-def get_disk_list(spinner: Spinner) -> Optional[str]:
-    """Gets the output of 'diskutil list'."""
+def get_disk_list(spinner: Spinner) -> Optional[Dict[str, Any]]:
+    """Gets the parsed output of 'diskutil list -plist'."""
     spinner.start("Scanning disk list...")
-    ret_code, stdout, stderr = run_command(['diskutil', 'list'], check=False)
+    ret_code, stdout, stderr = run_command(['diskutil', 'list', '-plist'], check=False)
     if ret_code != 0:
-        spinner.stop(f"{COLORS['RED']}✗ Failed to get disk list.{COLORS['RESET']}")
+        spinner.stop(f"{_FAIL}Failed to get disk list.{_END}")
         log(f"Error running diskutil: {stderr}", "ERROR")
         return None
-    spinner.stop(f"{COLORS['GREEN']}✓ Disk scan complete.{COLORS['RESET']}")
-    log(f"diskutil list output:\n{stdout}", "DEBUG")
-    return stdout
+    try:
+        disk_info = plistlib.loads(stdout.encode('utf-8'))
+    except Exception as e:
+        spinner.stop(f"{_FAIL}Failed to parse disk list.{_END}")
+        log(f"Error parsing 'diskutil list -plist' output: {e}", "ERROR")
+        return None
+    spinner.stop(f"{_OK}Disk scan complete.{_END}")
+    log(f"diskutil list reported {len(disk_info.get('AllDisksAndPartitions', []))} disk(s)", "DEBUG")
+    return disk_info
+
+
+def _is_efi_partition(partition: Dict[str, Any]) -> bool:
+    """Helper to decide whether a 'diskutil list -plist' partition entry is an EFI partition."""
+    content = partition.get('Content', '')
+    if content in EFI_CONTENT_TYPES:
+        return True
+    # APFS ISC partitions only count when labelled like an ESP
+    return content == 'Apple_APFS_ISC' and partition.get('VolumeName', '').upper() in EFI_VOLUME_NAMES
 
 
-def get_efi_partitions(disk_info: str) -> List[str]:
-    """Extracts EFI partition identifiers (e.g., disk0s1) from diskutil output."""
+def get_efi_partitions(disk_info: Dict[str, Any]) -> List[str]:
+    """Extracts EFI partition identifiers (e.g., disk0s1) from parsed 'diskutil list -plist' data."""
     log("Analyzing disk information for EFI partitions...", "INFO", timestamp=False)
     efi_partitions = []
-    current_disk = None
-    # Regex to find partition identifiers like /dev/diskXsY
-    disk_id_pattern = re.compile(r'(/dev/disk\d+)\s+\(')
-    # Regex to find EFI partitions by type and name/label
-    # Looks for 'EFI' type and common names/labels or APFS ISC type
-    efi_partition_pattern = re.compile(
-        r'\s+(\d+):\s+(Apple_APFS_ISC|EFI)\s+(EFI|ESP|BOOTCAMP|BOOT|NO NAME)\s+.*',
-        re.IGNORECASE
-    )
-    # Regex to find EFI partition by GPT type GUID directly (C12A7328...)
-    efi_guid_pattern = re.compile(r'\s+(\d+):\s+C12A7328-F81F-11D2-BA4B-00A0C93EC93B\s+.*')
-
-    for line in disk_info.splitlines():
-        disk_match = disk_id_pattern.match(line)
-        if disk_match:
-            current_disk = disk_match.group(1) # e.g., /dev/disk0
-            log(f"Processing disk: {current_disk}", "DEBUG")
-            continue # Move to the next line after finding a disk identifier
-
-        if not current_disk:
-            continue # Skip lines until we identify a disk
-
-        log(f" Checking line for EFI: {line.strip()}", "DEBUG")
-        efi_match = efi_partition_pattern.search(line)
-        guid_match = efi_guid_pattern.search(line)
-
-        partition_num = None
-        if efi_match:
-            partition_num = efi_match.group(1)
-            log(f"  Found potential EFI by name/type match: num={partition_num}", "DEBUG")
-        elif guid_match:
-            partition_num = guid_match.group(1)
-            log(f"  Found potential EFI by GUID match: num={partition_num}", "DEBUG")
-
-        if partition_num:
-            # Construct the identifier like diskXsY from /dev/diskX and partition_num Y
-            disk_num = current_disk.replace('/dev/disk', '')
-            partition_id = f"disk{disk_num}s{partition_num}"
-            if partition_id not in efi_partitions:
+
+    for disk in disk_info.get('AllDisksAndPartitions', []):
+        log(f"Processing disk: {disk.get('DeviceIdentifier')}", "DEBUG")
+        for partition in disk.get('Partitions', []):
+            partition_id = partition.get('DeviceIdentifier')
+            if partition_id and _is_efi_partition(partition) and partition_id not in efi_partitions:
                 efi_partitions.append(partition_id)
-                log(f"  Identified EFI partition: {partition_id}", "DEBUG", timestamp=False)
+                _KNOWN_MOUNT_POINTS[partition_id] = partition.get('MountPoint') or None
+                _KNOWN_VOLUME_UUIDS[partition_id] = partition.get('VolumeUUID')
+                log(f"  Identified EFI partition: {partition_id} ({partition.get('Content')})", "DEBUG", timestamp=False)
 
     if efi_partitions:
         log(f"Found {len(efi_partitions)} potential EFI partition(s): {', '.join(efi_partitions)}", "SUCCESS", timestamp=False)
@@ -271,75 +332,84 @@ def get_efi_partitions(disk_info: str) -> List[str]:
     return efi_partitions
 
 
+def get_disk_info(target: str) -> Optional[Dict[str, Any]]:
+    """Returns the parsed 'diskutil info -plist' output for a device or mount point."""
+    ret_code, stdout, stderr = run_command(['diskutil', 'info', '-plist', target], check=False)
+    if ret_code != 0:
+        if "could not find" in (stderr or stdout).lower():
+            log(f"  Device {target} not found by diskutil info.", "DEBUG")
+        else:
+            log(f"  diskutil info failed for {target}: {stderr}", "DEBUG")
+        return None
+    try:
+        return plistlib.loads(stdout.encode('utf-8'))
+    except Exception as e:
+        log(f"  Could not parse diskutil info output for {target}: {e}", "DEBUG")
+        return None
+
+
 def check_if_mounted(partition_id: str) -> Optional[str]:
     """Checks if a partition (e.g., disk0s1) is mounted and returns its mount point."""
     log(f"  Checking mount status for {partition_id}...", "DEBUG", timestamp=False)
+    # Reuse the state from the disk scan instead of spawning 'diskutil info' again
+    if partition_id in _KNOWN_MOUNT_POINTS:
+        mount_point = _KNOWN_MOUNT_POINTS[partition_id]
+        log(f"  Partition {partition_id} mount state from disk scan: {mount_point or 'not mounted'}", "DEBUG", timestamp=False)
+        return mount_point
+
     # Use full device path for diskutil info
     device_path = f"/dev/{partition_id}"
-    ret_code, stdout, stderr = run_command(['diskutil', 'info', device_path], check=False)
-    if ret_code == 0:
-        mount_point_match = re.search(r"Mount Point:\s+(.*)", stdout)
-        mounted_match = re.search(r"Mounted:\s+(Yes|No)", stdout)
-
-        if mounted_match and mounted_match.group(1) == "Yes":
-            if mount_point_match:
-                mount_point = mount_point_match.group(1).strip()
-                if mount_point and mount_point != "Not Mounted":
-                    log(f"  Partition {partition_id} is mounted at {mount_point}", "DEBUG", timestamp=False)
-                    return mount_point
-            # If Mounted is Yes but no mount point found, still return something to indicate mounted status
-            log(f"  Partition {partition_id} is mounted but mount point parsing failed. Assuming mounted.", "DEBUG")
-            # Attempt to find mount point via 'mount' command as fallback
-            ret_code_mount, stdout_mount, _ = run_command(['mount'], check=False)
-            if ret_code_mount == 0:
-                 mount_pattern = re.compile(rf"{device_path}\s+on\s+(/\S+)\s+\(")
-                 mp_match = mount_pattern.search(stdout_mount)
-                 if mp_match:
-                     mount_point = mp_match.group(1)
-                     log(f"  Found mount point via 'mount' command: {mount_point}", "DEBUG")
-                     return mount_point
-            return "/Volumes/UnknownEFI" # Placeholder if really can't find it
-    elif "could not find" in stderr.lower():
-         log(f"  Device {device_path} not found by diskutil info.", "DEBUG")
-    else:
-         log(f"  diskutil info failed for {device_path}: {stderr}", "DEBUG")
+    info = get_disk_info(device_path)
+    mount_point = info.get('MountPoint') if info else None
+    if mount_point:
+        log(f"  Partition {partition_id} is mounted at {mount_point}", "DEBUG", timestamp=False)
+        return mount_point
 
     log(f"  Partition {partition_id} is not mounted.", "DEBUG", timestamp=False)
     return None
 
 
+def _forget_mount_state(target: str) -> None:
+    """Drops cached mount state for a partition ID or mount point after it changes."""
+    for partition_id, mount_point in list(_KNOWN_MOUNT_POINTS.items()):
+        if target in (partition_id, mount_point):
+            _KNOWN_MOUNT_POINTS.pop(partition_id, None)
+
+
 def mount_efi(partition_id: str, spinner: Spinner) -> Optional[str]:
     """Mounts the specified EFI partition (e.g., disk0s1)."""
     spinner.start(f"Attempting to mount {partition_id}...")
 
     mount_point = check_if_mounted(partition_id)
     if mount_point:
-        spinner.stop(f"{COLORS['GREEN']}✓ Partition {partition_id} already mounted at {mount_point}{COLORS['RESET']}")
+        spinner.stop(f"{_OK}Partition {partition_id} already mounted at {mount_point}{_END}")
         return mount_point
 
     # Standard mount attempt using partition ID
     ret_code, stdout, stderr = run_command(['diskutil', 'mount', partition_id], check=False)
+    _forget_mount_state(partition_id)
 
     if ret_code == 0:
-        mount_point_match = re.search(r"mounted at\s+(.*)", stdout, re.IGNORECASE)
-        if mount_point_match:
-            mount_point = mount_point_match.group(1).strip()
-            spinner.stop(f"{COLORS['GREEN']}✓ Successfully mounted {partition_id} at {mount_point}{COLORS['RESET']}")
+        # diskutil prints at most one "mounted at <path>"; no regex needed
+        _, sep, tail = stdout.partition("mounted at")
+        if sep and tail.strip():
+            mount_point = tail.strip().splitlines()[0].strip()
+            spinner.stop(f"{_OK}Successfully mounted {partition_id} at {mount_point}{_END}")
             return mount_point
         else:
             # Mounted but couldn't parse mount point? Check again.
             spinner.set_message(f"Verifying mount point for {partition_id}...")
             mount_point = check_if_mounted(partition_id)
             if mount_point:
-                spinner.stop(f"{COLORS['GREEN']}✓ Successfully mounted {partition_id} at {mount_point} (verified){COLORS['RESET']}")
+                spinner.stop(f"{_OK}Successfully mounted {partition_id} at {mount_point} (verified){_END}")
                 return mount_point
             else:
-                 spinner.stop(f"{COLORS['YELLOW']}⚠ Mounted {partition_id} but failed to determine mount point.{COLORS['RESET']}")
+                 spinner.stop(f"{_WARN}Mounted {partition_id} but failed to determine mount point.{_END}")
                  log(f"diskutil output: {stdout}", "DEBUG")
                  return None # Uncertain state
 
     # Mount failed
-    spinner.stop(f"{COLORS['RED']}✗ Failed to mount {partition_id} using 'diskutil mount'.{COLORS['RESET']}")
+    spinner.stop(f"{_FAIL}Failed to mount {partition_id} using 'diskutil mount'.{_END}")
     log(f"Error details: {stderr if stderr else stdout}", "ERROR")
     log("Possible reasons: Permissions, SIP enabled, filesystem issues, or incorrect partition.", "INFO")
     log("Try mounting manually using Disk Utility, then run this script with the config.plist path.", "INFO")
@@ -347,8 +417,19 @@ def mount_efi(partition_id: str, spinner: Spinner) -> Optional[str]:
     return None
 
 
+# Set once check_system_constraints has reported; the answers don't change within a run
+_SYSTEM_CONSTRAINTS_CHECKED = False
+_SYSTEM_CONSTRAINTS_LOCK = threading.Lock() # mount_efi runs on several pool threads at once
+
+
 def check_system_constraints() -> None:
-    """Checks for system constraints like SIP that might affect mounting."""
+    """Checks for system constraints like SIP that might affect mounting (once per run)."""
+    global _SYSTEM_CONSTRAINTS_CHECKED
+    with _SYSTEM_CONSTRAINTS_LOCK:
+        if _SYSTEM_CONSTRAINTS_CHECKED:
+            return
+        _SYSTEM_CONSTRAINTS_CHECKED = True
+
     try:
         ret_code, stdout, stderr = run_command(['csrutil', 'status'], check=False)
         if ret_code == 0 and "enabled" in stdout.lower():
@@ -370,7 +451,7 @@ def unmount_partition(partition_or_mount_point: str, spinner: Spinner) -> bool:
     """Unmounts a partition or mount point."""
     # Determine if we have a partition ID (like disk0s1) or a mount point path
     is_path = "/" in partition_or_mount_point
-    is_partition_id = re.match(r'^disk\d+s\d+$', partition_or_mount_point) is not None
+    is_partition_id = PARTITION_ID_RE.match(partition_or_mount_point) is not None
 
     if not is_path and not is_partition_id:
          log(f"Cannot determine how to unmount target: {partition_or_mount_point}", "ERROR")
@@ -384,7 +465,7 @@ def unmount_partition(partition_or_mount_point: str, spinner: Spinner) -> bool:
     if is_partition_id:
         current_mount_point = check_if_mounted(partition_or_mount_point)
         if not current_mount_point:
-            spinner.stop(f"{COLORS['YELLOW']}⚠ {target_desc} was already unmounted.{COLORS['RESET']}")
+            spinner.stop(f"{_WARN}{target_desc} was already unmounted.{_END}")
             return True
         target_to_unmount = current_mount_point # Prefer unmounting by path if possible
         log(f"  Found {partition_or_mount_point} mounted at {current_mount_point}, unmounting path.", "DEBUG")
@@ -396,10 +477,18 @@ def unmount_partition(partition_or_mount_point: str, spinner: Spinner) -> bool:
         target_to_unmount = partition_or_mount_point
 
 
-    # Try standard unmount first
-    ret_code, stdout, stderr = run_command(['diskutil', 'unmount', target_to_unmount], check=False)
+    _forget_mount_state(partition_or_mount_point)
+    _forget_mount_state(target_to_unmount)
+
+    # Try standard unmount first; only back off and retry if diskutil reports the volume busy
+    for attempt in range(3):
+        ret_code, stdout, stderr = run_command(['diskutil', 'unmount', target_to_unmount], check=False)
+        if ret_code == 0 or attempt == 2 or "busy" not in (stderr or stdout).lower():
+            break
+        log(f"  {target_to_unmount} is busy, retrying unmount (attempt {attempt + 2}/3)...", "DEBUG")
+        time.sleep(0.05 * (1 << attempt))
     if ret_code == 0:
-        spinner.stop(f"{COLORS['GREEN']}✓ Successfully unmounted {target_desc}{COLORS['RESET']}")
+        spinner.stop(f"{_OK}Successfully unmounted {target_desc}{_END}")
         return True
 
     # If standard unmount failed, log and potentially try force
@@ -413,25 +502,41 @@ def unmount_partition(partition_or_mount_point: str, spinner: Spinner) -> bool:
         is_still_mounted = Path(target_to_unmount).is_mount()
 
     if not is_still_mounted:
-         spinner.stop(f"{COLORS['YELLOW']}⚠ {target_desc} seems to be unmounted now (verified after failed attempt).{COLORS['RESET']}")
+         spinner.stop(f"{_WARN}{target_desc} seems to be unmounted now (verified after failed attempt).{_END}")
          return True
 
-    # Try force unmount (requires sudo)
+    # Try force unmount (main() already requires root, so no extra sudo process)
     log(f"Attempting force unmount for {target_to_unmount}...", "WARNING")
     ret_code_force, stdout_force, stderr_force = run_command(
-        ['sudo', 'diskutil', 'unmount', 'force', target_to_unmount],
+        ['diskutil', 'unmount', 'force', target_to_unmount],
         check=False
     )
     if ret_code_force == 0:
-         spinner.stop(f"{COLORS['GREEN']}✓ Successfully force-unmounted {target_desc}{COLORS['RESET']}")
+         spinner.stop(f"{_OK}Successfully force-unmounted {target_desc}{_END}")
          return True
 
-    spinner.stop(f"{COLORS['RED']}✗ Failed to unmount {target_desc} even with force.{COLORS['RESET']}")
+    spinner.stop(f"{_FAIL}Failed to unmount {target_desc} even with force.{_END}")
     log(f"Error details (force unmount): {stderr_force if stderr_force else stdout_force}", "ERROR")
     log("Please try unmounting manually using Disk Utility.", "WARNING")
     return False
 
 
+# Max entries _log_dir_contents prints per directory
+_DIR_LISTING_LIMIT = 50
+
+
+def _log_dir_contents(directory: Path) -> None:
+    """Helper to debug-log a directory listing (scandir reuses d_type, no per-entry stat)."""
+    log(f"Contents of {directory}:", "DEBUG")
+    with os.scandir(directory) as it:
+        for i, entry in enumerate(it):
+            if i >= _DIR_LISTING_LIMIT:
+                log(f"  ... (truncated after {_DIR_LISTING_LIMIT} entries)", "DEBUG", timestamp=False)
+                break # Stop reading the directory, not just logging
+            suffix = '/' if entry.is_dir(follow_symlinks=False) else ''
+            log(f"  - {entry.name}{suffix}", "DEBUG", timestamp=False)
+
+
 def find_opencore_config(mount_point: Path, spinner: Spinner) -> Optional[Path]:
     """Finds the OpenCore config.plist in a standard location."""
     spinner.start(f"Searching for OpenCore config.plist in {mount_point}...")
@@ -439,23 +544,22 @@ def find_opencore_config(mount_point: Path, spinner: Spinner) -> Optional[Path]:
     log(f" Looking for: {expected_path}", "DEBUG")
 
     if expected_path.is_file():
-        spinner.stop(f"{COLORS['GREEN']}✓ Found OpenCore config.plist at: {expected_path}{COLORS['RESET']}")
+        spinner.stop(f"{_OK}Found OpenCore config.plist at: {expected_path}{_END}")
         return expected_path
     else:
-        spinner.stop(f"{COLORS['YELLOW']}⚠ Standard OpenCore config.plist not found at {expected_path}{COLORS['RESET']}")
-        # Optionally, list contents for debugging
+        spinner.stop(f"{_WARN}Standard OpenCore config.plist not found at {expected_path}{_END}")
+        if not DEBUG_MODE:
+            return None # The listings below are debug output only; skip their I/O on FAT32
+
+        # List contents for debugging
         try:
              efi_dir = mount_point / "EFI"
              if efi_dir.is_dir():
-                 log(f"Contents of {efi_dir}:", "DEBUG")
-                 for item in sorted(efi_dir.iterdir()):
-                     log(f"  - {item.name}{'/' if item.is_dir() else ''}", "DEBUG", timestamp=False)
+                 _log_dir_contents(efi_dir)
 
                  oc_dir = efi_dir / "OC"
                  if oc_dir.is_dir():
-                     log(f"Contents of {oc_dir}:", "DEBUG")
-                     for item in sorted(oc_dir.iterdir()):
-                         log(f"  - {item.name}{'/' if item.is_dir() else ''}", "DEBUG", timestamp=False)
+                     _log_dir_contents(oc_dir)
                  else:
                      log(f" OC directory not found within {efi_dir}", "DEBUG")
              else:
@@ -466,178 +570,239 @@ def find_opencore_config(mount_point: Path, spinner: Spinner) -> Optional[Path]:
         return None
 
 
-def check_patches_exist(config_data: Dict[str, Any]) -> bool:
-    """Checks if the specific BT patches already exist in the loaded config data."""
+def probe_efi_partition(partition_id: str, mounted_partitions: Dict[str, str],
+                        mounted_lock: threading.Lock) -> Tuple[str, Optional[Path]]:
+    """
+    Mounts a partition and looks for an OpenCore config on it.
+    Safe to run concurrently: successful mounts are recorded in mounted_partitions under mounted_lock.
+    """
+    log(f"Processing partition {partition_id}", "INFO")
+    # Concurrent probes can't share one animated terminal line
+    spinner = Spinner(animate=False)
+    mount_point_str = mount_efi(partition_id, spinner)
+    if not mount_point_str:
+        log(f"Skipping partition {partition_id} due to mount failure.", "WARNING")
+        return partition_id, None
+
+    with mounted_lock:
+        mounted_partitions[partition_id] = mount_point_str # Track for cleanup
+
+    config_path = find_opencore_config(Path(mount_point_str), spinner)
+    if not config_path:
+        log(f" No config found on {partition_id}.", "INFO")
+    return partition_id, config_path
+
+
+def load_last_efi_partition(efi_partitions: List[str]) -> Optional[str]:
+    """Returns the cached partition that last held the config, if it is still the same volume."""
+    try:
+        cached = json.loads(LAST_EFI_CACHE.read_text())
+        partition_id = cached['partition']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None # No cache yet, or unreadable: fall back to a full scan
+
+    if partition_id not in efi_partitions:
+        return None
+    # Identifiers can shift between boots (e.g. external disks); require the same volume
+    volume_uuid = _KNOWN_VOLUME_UUIDS.get(partition_id)
+    if not volume_uuid or cached.get('volume_uuid') != volume_uuid:
+        log(f"  Cached EFI partition {partition_id} is now a different volume, ignoring cache.", "DEBUG")
+        return None
+    log(f"  Last known OpenCore EFI partition: {partition_id}", "DEBUG")
+    return partition_id
+
+
+def save_last_efi_partition(partition_id: str) -> None:
+    """Records the partition that held the config so the next run probes it first."""
+    volume_uuid = _KNOWN_VOLUME_UUIDS.get(partition_id)
+    if not volume_uuid:
+        return # Without a volume UUID a later run couldn't tell whether the identifier still matches
+    try:
+        LAST_EFI_CACHE.parent.mkdir(parents=True, exist_ok=True)
+        LAST_EFI_CACHE.write_text(json.dumps({
+            'partition': partition_id,
+            'volume_uuid': volume_uuid,
+        }))
+    except OSError as e:
+        log(f"  Could not write EFI cache {LAST_EFI_CACHE}: {e}", "DEBUG") # Cache is only an optimization
+
+
+def check_patches_exist(config_data: Dict[str, Any]) -> Optional[Tuple[bool, FrozenSet[str]]]:
+    """
+    Checks if the specific BT patches already exist in the loaded config data.
+    Returns whether both are present, plus the patch comments that were found,
+    or None if the check itself failed.
+    """
     log("  Checking for existing Bluetooth patches...", "DEBUG", timestamp=False)
     try:
         kernel_patches = config_data.get('Kernel', {}).get('Patch', [])
         if not isinstance(kernel_patches, list):
             log("Kernel->Patch section is not a list. Cannot reliably check.", "WARNING")
-            return False # Treat as not existing to allow patching attempt
-
-        found_patch_1 = False
-        found_patch_2 = False
-        for patch in kernel_patches:
-            if isinstance(patch, dict):
-                 comment = patch.get('Comment', '')
-                 if comment == PATCH_COMMENT_1:
-                     found_patch_1 = True
-                     log(f"  Found existing patch 1: {comment}", "DEBUG", timestamp=False)
-                 elif comment == PATCH_COMMENT_2:
-                     found_patch_2 = True
-                     log(f"  Found existing patch 2: {comment}", "DEBUG", timestamp=False)
-
-        # Return True only if *both* specific patches are found
-        if found_patch_1 and found_patch_2:
+            return False, frozenset() # Treat as not existing to allow patching attempt
+
+        # One set build in C instead of per-patch comparisons in Python; only string comments
+        # are collected, so an unhashable Comment in some unrelated patch can't break the check
+        existing_comments = {
+            patch.get('Comment') for patch in kernel_patches
+            if isinstance(patch, dict) and isinstance(patch.get('Comment'), str)
+        }
+        found = _PATCH_COMMENTS & existing_comments
+        for comment in found:
+            log(f"  Found existing patch: {comment}", "DEBUG", timestamp=False)
+
+        # Report True only if *both* specific patches are found
+        if found == _PATCH_COMMENTS:
             log("  Both required Bluetooth patches found.", "DEBUG", timestamp=False)
-            return True
-        elif found_patch_1 or found_patch_2:
-            log("  Found only one of the two required patches. Will proceed to add both.", "WARNING")
-            return False # Treat as incomplete/missing
+            return True, found
+        elif found:
+            log("  Found only one of the two required patches. Will proceed to add the missing one.", "WARNING")
+            return False, found # Treat as incomplete/missing
         else:
              log("  No existing Bluetooth patches found.", "DEBUG", timestamp=False)
-             return False
+             return False, found
     except Exception as e:
         log(f"Error checking for existing patches: {e}", "ERROR")
-        return False # Assume not present if check fails
+        return None # Unknown: patches may be present, so the caller must not add them blindly
 
 
-def _create_patch_dict(comment: str, find_b64: str, replace_b64: str, min_kernel: str) -> Dict[str, Any]:
+def _create_patch_dict(comment: str, find: bytes, replace: bytes, min_kernel: str) -> Dict[str, Any]:
     """Helper to create a patch dictionary."""
     return {
         'Arch': 'x86_64', 'Base': '', 'Comment': comment, 'Count': 1, 'Enabled': True,
-        'Find': base64.b64decode(find_b64), 'Identifier': 'kernel', 'Limit': 0, 'Mask': b'',
+        'Find': find, 'Identifier': 'kernel', 'Limit': 0, 'Mask': b'',
         'MaxKernel': '', 'MinKernel': min_kernel,
-        'Replace': base64.b64decode(replace_b64), 'ReplaceMask': b'', 'Skip': 0,
+        'Replace': replace, 'ReplaceMask': b'', 'Skip': 0,
     }
 
 
-def add_kernel_patches(config_path: Path, spinner: Spinner) -> Literal["success", "already_exists", "error"]:
-    """
-    Adds the Sonoma VM BT Enabler kernel patches to the config.plist.
-    Includes pre-conversion to XML format for robustness.
-    """
-    log(f"Starting patch process for: {config_path}", "HEADER")
-    # Create a unique backup name based on timestamp
-    backup_path = config_path.with_suffix(config_path.suffix + f'.backup_{int(time.time())}')
+# Patch templates are built once at import; add_kernel_patches copies them
+_PATCH1_TEMPLATE = _create_patch_dict(
+    comment=PATCH_COMMENT_1,
+    find=b'hibernatehidready\x00hibernatecount\x00',
+    replace=b'hibernatehidready\x00hv_vmm_present\x00',
+    min_kernel='20.4.0'
+)
+_PATCH2_TEMPLATE = _create_patch_dict(
+    comment=PATCH_COMMENT_2,
+    find=b'boot session UUID\x00hv_vmm_present\x00',
+    replace=b'boot session UUID\x00hibernatecount\x00',
+    min_kernel='22.0.0'
+)
 
-    # --- 1. Create Backup ---
-    spinner.start(f"Creating backup: {backup_path.name}")
+
+def _fsync_directory(directory: Path) -> None:
+    """Helper to make a rename inside a directory durable."""
     try:
-        shutil.copy2(config_path, backup_path)
-        spinner.stop(f"{COLORS['GREEN']}✓ Backup created successfully.{COLORS['RESET']}")
-        log(f"  Backup saved to: {backup_path}", "DEBUG")
-    except Exception as e:
-        spinner.stop(f"{COLORS['RED']}✗ Error creating backup: {e}{COLORS['RESET']}")
-        return "error"
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError as e:
+        log(f"  Could not open {directory} for fsync: {e}", "DEBUG")
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError as e:
+        # Some filesystems (e.g. FAT32 on macOS) don't support fsync on directories
+        log(f"  Directory fsync not supported for {directory}: {e}", "DEBUG")
+    finally:
+        os.close(dir_fd)
+
 
-    # --- 2. Check and Convert Plist to XML Format using plutil ---
-    spinner.start("Checking and ensuring config.plist is in XML format...")
+def _fast_backup(src: Path, dst: Path) -> str:
+    """Keeps a copy of src at dst without copying bytes where possible; returns the method used.
+
+    A hard link is only a valid backup because config.plist is never rewritten in
+    place: the patched file is swapped in with os.replace, leaving the old inode
+    (and so the link) untouched.
+    """
     try:
-        # First, lint the file to catch major errors before conversion
-        lint_cmd = ['plutil', '-lint', str(config_path)]
-        ret_code_lint, _, stderr_lint = run_command(lint_cmd, check=False)
-        if ret_code_lint != 0:
-            spinner.stop(f"{COLORS['RED']}✗ Plist validation failed (plutil -lint).{COLORS['RESET']}")
-            log(f"Error from plutil: {stderr_lint}", "ERROR")
-            log("The config file is likely corrupted. Please fix it manually or restore from a known good backup.", "INFO")
-            # Don't restore our backup here, original file wasn't touched by us yet
-            return "error"
-
-        # Convert to XML format (this command is idempotent if already XML)
-        convert_cmd = ['plutil', '-convert', 'xml1', str(config_path)]
-        ret_code_convert, _, stderr_convert = run_command(convert_cmd, check=False)
-        if ret_code_convert != 0:
-            spinner.stop(f"{COLORS['RED']}✗ Failed to convert plist to XML format.{COLORS['RESET']}")
-            log(f"Error during 'plutil -convert xml1': {stderr_convert}", "ERROR")
-            log("Attempting to restore original file from backup...", "INFO")
-            try:
-                # Use move to restore the original state saved in backup
-                shutil.move(str(backup_path), config_path)
-                log("Original file restored from backup.", "SUCCESS")
-            except Exception as restore_e:
-                log(f"CRITICAL: Failed to restore from backup '{backup_path}': {restore_e}", "ERROR")
-                log(f"Your original file might be at '{backup_path}'. Manual recovery needed.", "ERROR")
-            return "error"
+        os.link(src, dst)
+        return "hard link"
+    except OSError as e: # Cross-device, or FAT32 which has no hard links
+        log(f"  Hard link backup not possible ({e}), copying instead.", "DEBUG")
+    shutil.copy2(src, dst)
+    return "copy"
 
-        spinner.stop(f"{COLORS['GREEN']}✓ Config checked and converted to XML format.{COLORS['RESET']}")
 
-    except Exception as e:
-        spinner.stop(f"{COLORS['RED']}✗ Unexpected error during plist check/conversion: {e}{COLORS['RESET']}")
-        log("Attempting to restore original file from backup...", "INFO")
-        try:
-            shutil.move(str(backup_path), config_path)
-            log("Original file restored from backup.", "SUCCESS")
-        except Exception as restore_e:
-            log(f"CRITICAL: Failed to restore from backup '{backup_path}': {restore_e}", "ERROR")
-        return "error"
+# What plistlib raises for unreadable input: unknown format (incl. empty files), malformed XML,
+# a malformed <integer>/<real>/<data> value (ValueError, which covers binascii.Error),
+# or a malformed <date> (AttributeError from its failed regex match)
+_PLIST_PARSE_ERRORS = (InvalidFileException, ExpatError, ValueError, AttributeError)
+
 
+def _load_plist(path: Path) -> Any:
+    """Parses a plist (XML or binary) from a single read of the file."""
+    data = path.read_bytes()
+    log(f"  Read {len(data)} bytes from {path.name}", "DEBUG") # Size comes from the buffer, no stat
+    return plistlib.loads(data)
 
-    # --- 3. Read Plist (Now likely XML) ---
+
+def add_kernel_patches(config_path: Path, spinner: Spinner) -> Literal["success", "already_exists", "error"]:
+    """
+    Adds the Sonoma VM BT Enabler kernel patches to the config.plist.
+    XML and binary plists are parsed directly; plutil is only used to repair
+    files plistlib rejects. The result is always written as XML.
+
+    The original file is never modified in place: the patched plist is written to
+    a temporary file and swapped in with os.replace, so any failure leaves it intact.
+    Just before the swap the original is kept as config.plist.backup_<timestamp>,
+    so a patched config that doesn't boot can be rolled back by hand.
+    """
+    log(f"Starting patch process for: {config_path}", "HEADER")
+
+    # --- 1. Read Plist ---
     spinner.start("Reading config.plist...")
     config_data: Optional[Dict[str, Any]] = None
     try:
-        # DEBUG: Log file size before reading
         try:
-            file_size = config_path.stat().st_size
-            log(f"  File size after conversion: {file_size} bytes", "DEBUG")
-        except Exception as stat_e:
-            log(f"  Could not get file size: {stat_e}", "DEBUG")
-
-        with config_path.open('rb') as f:
-            config_data = plistlib.load(f)
-        spinner.stop(f"{COLORS['GREEN']}✓ Config file loaded successfully.{COLORS['RESET']}")
+            # plistlib detects XML vs binary itself, so the common case needs no plutil spawn
+            config_data = _load_plist(config_path)
+        except _PLIST_PARSE_ERRORS as parse_e:
+            # plutil accepts more than plistlib (e.g. OpenStep syntax); let it repair into an XML copy.
+            # The original stays untouched; the patched write below replaces it.
+            log(f"  plistlib could not parse the config ({parse_e}), trying 'plutil -convert xml1'.", "DEBUG")
+            spinner.set_message("Converting config.plist to XML with plutil...")
+            converted_path = config_path.with_name(config_path.name + '.xml_tmp')
+            try:
+                convert_cmd = ['plutil', '-convert', 'xml1', '-o', str(converted_path), str(config_path)]
+                ret_code_convert, _, stderr_convert = run_command(convert_cmd, check=False, capture_output=False)
+                if ret_code_convert != 0:
+                    spinner.stop(f"{_FAIL}Plist validation failed (plutil could not read it).{_END}")
+                    log(f"Error from plutil: {stderr_convert}", "ERROR")
+                    log("The config file is likely corrupted. Please fix it manually or restore from a known good backup.", "INFO")
+                    return "error"
+                config_data = _load_plist(converted_path)
+            finally:
+                converted_path.unlink(missing_ok=True) # Converted copy is only needed for parsing
+        spinner.stop(f"{_OK}Config file loaded successfully.{_END}")
 
-    except FileNotFoundError: # Should not happen after checks, but safety
-        spinner.stop(f"{COLORS['RED']}✗ Error: Config file disappeared after conversion! {config_path}.{COLORS['RESET']}")
+    except FileNotFoundError:
+        spinner.stop(f"{_FAIL}Error: Config file disappeared! {config_path}.{_END}")
         log("This is unexpected. Check filesystem and permissions.", "ERROR")
-        log(f"Backup (pre-conversion state) available at: {backup_path}", "INFO")
         return "error"
-    except InvalidFileException as e:
-        spinner.stop(f"{COLORS['RED']}✗ Error: Invalid plist format even after plutil conversion.{COLORS['RESET']}")
+    except _PLIST_PARSE_ERRORS as e:
+        spinner.stop(f"{_FAIL}Error: Invalid plist format even after plutil conversion.{_END}")
         log(f"Plist parsing error: {e}", "ERROR")
         log("This suggests a deeper issue with the file structure or an uncommon encoding problem.", "INFO")
         log("Please manually inspect the file. Use 'plutil -lint' to check.", "INFO")
-        log(f"Backup (pre-conversion state) available at: {backup_path}", "INFO")
-        # Restore the backup created *before* plutil conversion attempt
-        try:
-            shutil.move(str(backup_path), config_path)
-            log("Original file (pre-conversion state) restored from backup.", "SUCCESS")
-        except Exception as restore_e:
-             log(f"CRITICAL: Failed to restore pre-conversion state from backup '{backup_path}': {restore_e}", "ERROR")
         return "error"
     except Exception as e:
-        spinner.stop(f"{COLORS['RED']}✗ Error reading config file: {e}{COLORS['RESET']}")
-        log(f"Backup (pre-conversion state) available at: {backup_path}", "INFO")
-        try:
-            shutil.move(str(backup_path), config_path)
-            log("Original file (pre-conversion state) restored from backup.", "SUCCESS")
-        except Exception as restore_e:
-             log(f"CRITICAL: Failed to restore pre-conversion state from backup '{backup_path}': {restore_e}", "ERROR")
+        spinner.stop(f"{_FAIL}Error reading config file: {e}{_END}")
         return "error"
 
     if not config_data: # Should not happen if exceptions are caught
-         spinner.stop(f"{COLORS['RED']}✗ Failed to load config data unexpectedly after read attempt.{COLORS['RESET']}")
-         # Attempt restore before exiting
-         try:
-            shutil.move(str(backup_path), config_path)
-            log("Original file (pre-conversion state) restored from backup.", "SUCCESS")
-         except Exception as restore_e:
-             log(f"CRITICAL: Failed to restore pre-conversion state from backup '{backup_path}': {restore_e}", "ERROR")
+         spinner.stop(f"{_FAIL}Failed to load config data unexpectedly after read attempt.{_END}")
          return "error"
 
-    # --- 4. Check if Patches Already Exist (using the loaded data) ---
-    if check_patches_exist(config_data):
+    # --- 2. Check if Patches Already Exist (using the loaded data) ---
+    patch_check = check_patches_exist(config_data)
+    if patch_check is None:
+        log("Could not determine whether the patches are already present. Not modifying the config.", "ERROR")
+        return "error"
+    patches_present, present_comments = patch_check
+    if patches_present:
         log("Patches already present in the configuration.", "SUCCESS", timestamp=False)
-        # Clean up backup if no changes are made AFTER conversion
-        try:
-            backup_path.unlink(missing_ok=True)
-            log(f"Removed unused backup: {backup_path.name}", "DEBUG")
-        except OSError as e:
-            log(f"Could not remove unused backup {backup_path}: {e}", "WARNING")
         return "already_exists"
 
-    # --- 5. Prepare and Add Patches ---
+    # --- 3. Prepare and Add Patches ---
     spinner.start("Preparing and adding patches...")
     try:
         # Ensure Kernel section exists
@@ -645,8 +810,7 @@ def add_kernel_patches(config_path: Path, spinner: Spinner) -> Literal["success"
             config_data['Kernel'] = {}
         if not isinstance(config_data['Kernel'], dict):
              log("Error: 'Kernel' key exists but is not a dictionary.", "ERROR")
-             spinner.stop(f"{COLORS['RED']}✗ Invalid config structure ('Kernel' not a dict).{COLORS['RESET']}")
-             shutil.move(str(backup_path), config_path) # Restore pre-conversion state
+             spinner.stop(f"{_FAIL}Invalid config structure ('Kernel' not a dict).{_END}")
              return "error"
 
         # Ensure Kernel -> Patch section exists and is a list
@@ -656,39 +820,27 @@ def add_kernel_patches(config_path: Path, spinner: Spinner) -> Literal["success"
             log("Warning: 'Kernel -> Patch' key exists but is not a list. Replacing with list.", "WARNING")
             config_data['Kernel']['Patch'] = [] # Replace invalid type with list
 
-        # Define patches
-        patch1 = _create_patch_dict(
-            comment=PATCH_COMMENT_1,
-            find_b64='aGliZXJuYXRlaGlkcmVhZHkAaGliZXJuYXRlY291bnQA',
-            replace_b64='aGliZXJuYXRlaGlkcmVhZHkAaHZfdm1tX3ByZXNlbnQA',
-            min_kernel='20.4.0'
-        )
-        patch2 = _create_patch_dict(
-            comment=PATCH_COMMENT_2,
-            find_b64='Ym9vdCBzZXNzaW9uIFVVSUQAaHZfdm1tX3ByZXNlbnQA',
-            replace_b64='Ym9vdCBzZXNzaW9uIFVVSUQAaGliZXJuYXRlY291bnQA',
-            min_kernel='22.0.0'
-        )
+        # Define patches (copies, so the module-level templates stay pristine)
+        patch1 = _PATCH1_TEMPLATE.copy()
+        patch2 = _PATCH2_TEMPLATE.copy()
 
-        # Add patches (avoid adding duplicates if check_patches_exist logic changes)
-        current_comments = {p.get('Comment') for p in config_data['Kernel']['Patch'] if isinstance(p, dict)}
-        if patch1['Comment'] not in current_comments:
+        # Add only the patches the existence check didn't find (no second scan of the Patch array)
+        if patch1['Comment'] not in present_comments:
              config_data['Kernel']['Patch'].append(patch1)
              log("Added Patch 1", "DEBUG")
-        if patch2['Comment'] not in current_comments:
+        if patch2['Comment'] not in present_comments:
              config_data['Kernel']['Patch'].append(patch2)
              log("Added Patch 2", "DEBUG")
 
-        spinner.stop(f"{COLORS['GREEN']}✓ Patches prepared and added to config data.{COLORS['RESET']}")
+        spinner.stop(f"{_OK}Patches prepared and added to config data.{_END}")
 
     except Exception as e:
-        spinner.stop(f"{COLORS['RED']}✗ Error preparing patches: {e}{COLORS['RESET']}")
+        spinner.stop(f"{_FAIL}Error preparing patches: {e}{_END}")
         log(f"Error details: {e}", "DEBUG")
-        shutil.move(str(backup_path), config_path) # Restore pre-conversion state
         return "error"
 
-    # --- 6. Write Updated Plist (Safely) ---
-    spinner.start("Validating and writing updated config.plist...")
+    # --- 4. Write Updated Plist (Safely) ---
+    spinner.start("Writing updated config.plist...")
     temp_path = None # Define outside try block for cleanup
     try:
         # Write to a temporary file first in the same directory
@@ -696,51 +848,36 @@ def add_kernel_patches(config_path: Path, spinner: Spinner) -> Literal["success"
                                          prefix=config_path.name + '.tmp_') as tmp_file:
             temp_path = Path(tmp_file.name)
             log(f" Writing patched data to temporary file: {temp_path}", "DEBUG")
-            plistlib.dump(config_data, tmp_file)
-
-        # Validate the temporary file by trying to load it back using plistlib
-        log(f"  Validating temporary file (plistlib): {temp_path}", "DEBUG")
-        with temp_path.open('rb') as f_validate:
-            plistlib.load(f_validate) # Throws exception if invalid
-
-        # Additionally validate using plutil for extra safety
-        log(f"  Validating temporary file (plutil): {temp_path}", "DEBUG")
-        lint_cmd_tmp = ['plutil', '-lint', str(temp_path)]
-        ret_code_lint_tmp, _, stderr_lint_tmp = run_command(lint_cmd_tmp, check=False)
-        if ret_code_lint_tmp != 0:
-            raise InvalidFileException(f"plutil validation failed for temporary file: {stderr_lint_tmp}")
-
-
-        # If validation passes, replace the original file atomically
-        log(f"  Validation successful. Replacing original file.", "DEBUG")
-        # os.replace might fail across filesystem boundaries if /tmp is different
-        # Using shutil.move is generally safer for this case
-        shutil.move(str(temp_path), config_path)
-        temp_path = None # Prevent deletion in finally if move succeeded
-
-        spinner.stop(f"{COLORS['GREEN']}✓ Successfully updated and saved {config_path}{COLORS['RESET']}")
-        # Backup is now outdated, remove it
-        try:
-            backup_path.unlink(missing_ok=True)
-            log(f"Removed successful backup: {backup_path.name}", "DEBUG")
-        except OSError as e:
-            log(f"Could not remove backup file {backup_path}: {e}", "WARNING")
+            # Serialize in memory first so the file gets a single large write
+            # sort_keys=False skips sorting every dict and keeps the config's original key order
+            plist_bytes = plistlib.dumps(config_data, sort_keys=False)
+            tmp_file.write(plist_bytes)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+
+        # Keep the pre-patch config for manual rollback; only made once a change is about to land
+        backup_path = config_path.with_suffix(config_path.suffix + f'.backup_{int(time.time())}')
+        method = _fast_backup(config_path, backup_path)
+        log(f"  Backup saved to: {backup_path} ({method})", "DEBUG")
+
+        # plistlib.dumps cannot emit an invalid plist for data it just serialized,
+        # so replace the original file atomically without re-validating it
+        log(f"  Replacing original file.", "DEBUG")
+        # Temp file lives next to the config, so this is a same-filesystem rename
+        os.replace(temp_path, config_path)
+        temp_path = None # Prevent deletion in finally if replace succeeded
+        _fsync_directory(config_path.parent)
+
+        spinner.stop(f"{_OK}Successfully updated and saved {config_path}{_END}")
+        log(f"Original config backed up to: {backup_path}", "INFO")
         return "success"
 
-    except InvalidFileException as e:
-         spinner.stop(f"{COLORS['RED']}✗ Validation failed: Written plist is invalid.{COLORS['RESET']}")
-         log(f"Error during validation: {e}", "ERROR")
-         log("Restoring original file (pre-patch state) from backup...", "INFO")
-         shutil.move(str(backup_path), config_path) # Restore pre-conversion state
-         return "error"
     except Exception as e:
-        spinner.stop(f"{COLORS['RED']}✗ Error writing or validating updated config file: {e}{COLORS['RESET']}")
+        spinner.stop(f"{_FAIL}Error writing updated config file: {e}{_END}")
         log(f"Error details: {e}", "DEBUG")
-        log("Restoring original file (pre-patch state) from backup...", "INFO")
-        shutil.move(str(backup_path), config_path) # Restore pre-conversion state
         return "error"
     finally:
-         # Clean up temp file if it still exists (i.e., move failed or validation failed)
+         # Clean up temp file if it still exists (i.e., write or move failed)
          if temp_path and temp_path.exists():
              log(f"Cleaning up temporary file: {temp_path}", "DEBUG")
              temp_path.unlink(missing_ok=True)
@@ -750,14 +887,16 @@ def restart_system(spinner: Spinner) -> bool:
     """Initiates a system restart with a countdown."""
     log("Initiating system restart...", "INFO")
     try:
+        spinner.start("System will restart in 5 seconds... (Press Ctrl+C to cancel)")
         for i in range(5, 0, -1):
-            spinner.start(f"System will restart in {i} seconds... (Press Ctrl+C to cancel)")
+            spinner.set_message(f"System will restart in {i} seconds... (Press Ctrl+C to cancel)")
             time.sleep(1)
         spinner.stop(f"{COLORS['GREEN']}Restarting now...{COLORS['RESET']}")
+        sys.stdout.flush() # Don't leave buffered (piped) output behind when the machine goes down
         # Use sudo explicitly for shutdown
-        ret_code, stdout, stderr = run_command(['sudo', 'shutdown', '-r', 'now'], check=False)
+        ret_code, _, stderr = run_command(['sudo', 'shutdown', '-r', 'now'], check=False, capture_output=False)
         if ret_code != 0:
-             log(f"Error initiating restart: {stderr if stderr else stdout}", "ERROR")
+             log(f"Error initiating restart: {stderr}", "ERROR")
              log("Please restart your system manually.", "WARNING")
              return False
         # If shutdown succeeds, script will terminate here.
@@ -808,6 +947,10 @@ def main() -> None:
         "--mount-only", "-m", action="store_true",
         help="Only attempt to mount EFI partitions and exit (useful for debugging mount issues)."
         )
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help=f"Don't read or update the last-used EFI partition cache ({LAST_EFI_CACHE})."
+        )
 
     args = parser.parse_args()
 
@@ -817,6 +960,8 @@ def main() -> None:
     if args.no_color or "NO_COLOR" in os.environ or not sys.stdout.isatty():
         for key in COLORS:
             COLORS[key] = ""
+        _build_log_styles()
+        _build_status_prefixes()
 
     DEBUG_MODE = args.debug
     if DEBUG_MODE:
@@ -845,17 +990,33 @@ def main() -> None:
             efi_partitions = get_efi_partitions(disk_info)
             if not efi_partitions: sys.exit(1)
 
-            mounted_count = 0
-            for partition in efi_partitions:
-                mount_point = mount_efi(partition, spinner)
-                if mount_point:
-                    mounted_partitions[partition] = mount_point
-                    log(f"Partition {partition} mounted at {mount_point}", "SUCCESS")
-                    log(f"-> To unmount later: diskutil unmount '{mount_point}'", "INFO")
-                    mounted_count += 1
-                # Error logged within mount_efi if it fails
+            mounted_lock = threading.Lock()
+
+            def mount_and_track(partition_id: str) -> None:
+                mount_point = mount_efi(partition_id, Spinner(animate=False))
+                if mount_point: # Error logged within mount_efi if it fails
+                    with mounted_lock:
+                        mounted_partitions[partition_id] = mount_point
+
+            # Issue every 'diskutil mount' at once; results are reported in partition order
+            try:
+                with ThreadPoolExecutor(max_workers=min(len(efi_partitions), 4)) as pool:
+                    futures = [pool.submit(mount_and_track, p) for p in efi_partitions]
+                    try:
+                        for future in futures:
+                            future.result()
+                    finally:
+                        for pending in futures:
+                            pending.cancel() # On Ctrl+C, don't start mounts that haven't begun
+            finally:
+                # Also reached on Ctrl+C, so partitions mounted before it are still reported
+                for partition in efi_partitions:
+                    mount_point = mounted_partitions.get(partition)
+                    if mount_point:
+                        log(f"Partition {partition} mounted at {mount_point}", "SUCCESS")
+                        log(f"-> To unmount later: diskutil unmount '{mount_point}'", "INFO")
             log("Mount-Only mode finished.", "HEADER")
-            if mounted_count == 0:
+            if not mounted_partitions:
                 log("No EFI partitions could be mounted.", "WARNING")
             # Keep partitions mounted in this mode
             sys.exit(0)
@@ -888,30 +1049,64 @@ def main() -> None:
 
             log(f"Scanning {len(efi_partitions)} EFI partition(s)...", "HEADER")
             found_config_path: Optional[Path] = None
-            processed_partition: Optional[str] = None
-
-            for i, partition_id in enumerate(efi_partitions):
-                log(f"[{i+1}/{len(efi_partitions)}] Processing partition {partition_id}", "INFO")
-                mount_point_str = mount_efi(partition_id, spinner)
-                if not mount_point_str:
-                    log(f"Skipping partition {partition_id} due to mount failure.", "WARNING")
-                    continue # Try next partition
-
-                mount_point = Path(mount_point_str)
-                mounted_partitions[partition_id] = mount_point_str # Track for cleanup
-                processed_partition = partition_id # Store the partition we are currently working on
-
-                config_path = find_opencore_config(mount_point, spinner)
+            found_partition: Optional[str] = None
+            mounted_lock = threading.Lock()
+
+            # Try the partition that held the config last time on its own first;
+            # if it still does, no other partition needs to be mounted at all
+            remaining = efi_partitions
+            last_partition = None if args.no_cache else load_last_efi_partition(efi_partitions)
+            if last_partition:
+                partition_id, config_path = probe_efi_partition(last_partition, mounted_partitions, mounted_lock)
                 if config_path:
                     found_config_path = config_path
-                    break # Found it, stop scanning
+                    found_partition = partition_id
+                    remaining = []
                 else:
-                     # Config not found, unmount before trying next partition
-                     log(f" No config found on {partition_id}. Unmounting...", "INFO")
-                     unmount_partition(mount_point_str, spinner) # Use mount point path for unmount
-                     del mounted_partitions[partition_id] # Remove from tracked list
-                     processed_partition = None
-
+                    remaining = [p for p in efi_partitions if p != last_partition]
+
+            # Mount and probe partitions concurrently, but pick the winner in partition order
+            if remaining:
+                with ThreadPoolExecutor(max_workers=min(len(remaining), 4)) as pool:
+                    futures = [
+                        pool.submit(probe_efi_partition, p, mounted_partitions, mounted_lock)
+                        for p in remaining
+                    ]
+                    try:
+                        for future in futures:
+                            partition_id, config_path = future.result()
+                            if config_path:
+                                found_config_path = config_path
+                                found_partition = partition_id
+                                break
+                    finally:
+                        # Once a config is found, or on Ctrl+C, probes that haven't started yet never
+                        # need to mount anything; the pool's exit then only waits for those in flight
+                        for pending in futures:
+                            pending.cancel()
+
+            if found_partition and found_partition != last_partition and not args.no_cache:
+                save_last_efi_partition(found_partition)
+
+            # Unmount every partition that didn't provide the config we'll patch, all at once
+            unused = [pid for pid in mounted_partitions if pid != found_partition]
+            if unused:
+                log(f" Not using {', '.join(unused)}. Unmounting...", "INFO")
+
+                def unmount_unused(partition_id: str) -> None:
+                    # Use mount point path for unmount; failures stay tracked so the final cleanup retries them
+                    if unmount_partition(mounted_partitions[partition_id], Spinner(animate=False)):
+                        with mounted_lock:
+                            del mounted_partitions[partition_id]
+
+                with ThreadPoolExecutor(max_workers=min(len(unused), 4)) as pool:
+                    futures = [pool.submit(unmount_unused, pid) for pid in unused]
+                    try:
+                        for future in futures:
+                            future.result()
+                    finally:
+                        for pending in futures:
+                            pending.cancel() # On Ctrl+C, leave the rest to the final cleanup
 
             if found_config_path:
                 config_to_patch = found_config_path
@@ -961,16 +1156,24 @@ def main() -> None:
 
                 else: # patch_result == "error"
                     log("Patching process failed. See errors above.", "ERROR")
-                    log("Original config.plist should have been restored from backup (check backup file too).", "INFO")
+                    log("The original config.plist was left unchanged.", "INFO")
                     exit_code = 1 # Indicate failure
 
+    except KeyboardInterrupt:
+        # A second Ctrl+C during cleanup should abort immediately instead of re-entering it
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        spinner.stop() # Disarm the frame timer before cleanup starts printing
+        print()
+        log("Interrupted by user. Cleaning up (press Ctrl+C again to abort)...", "WARNING")
+        exit_code = 130
+
     finally:
         # --- Cleanup ---
         if not args.mount_only and mounted_partitions:
             log("Cleaning up mounted partitions...", "HEADER")
             cleaned_up_count = 0
-            # Unmount in reverse order? Might not matter much.
-            for part_id, mp in list(mounted_partitions.items()): # Iterate over a copy
+            # Unmount in reverse mount order (LIFO) so later mounts never hold earlier ones busy
+            for part_id, mp in reversed(list(mounted_partitions.items())): # Iterate over a copy
                 log(f"Unmounting {mp} (from {part_id})...", "INFO")
                 if unmount_partition(mp, spinner): # Unmount by path
                     cleaned_up_count += 1
@@ -996,7 +1199,6 @@ if __name__ == "__main__":
     except Exception as e:
         # Generic fallback catcher
         log(f"An unexpected critical error occurred: {e}", "ERROR")
-        import traceback
         # Print stack trace regardless of debug mode for critical errors
         print("-" * 60)
         traceback.print_exc(file=sys.stdout)